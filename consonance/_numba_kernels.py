@@ -0,0 +1,16 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True, parallel=True)
+def octave_intervals(pitches, pitch_offsets, interval_offsets):
+    """Calculate pairwise octave intervals of every chord from flattened pitches, in a single pass."""
+    intervals = np.empty(interval_offsets[-1], dtype=np.int8)
+    for c in prange(len(pitch_offsets) - 1):
+        k = interval_offsets[c]
+        for a in range(pitch_offsets[c], pitch_offsets[c + 1]):
+            for b in range(a + 1, pitch_offsets[c + 1]):
+                ivl = (pitches[b] - pitches[a]) % 12
+                intervals[k] = 12 if ivl == 0 else ivl
+                k += 1
+    return intervals
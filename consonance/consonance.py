@@ -1,32 +1,32 @@
+import math
 import numpy as np
+import operator
+from functools import lru_cache
 from itertools import combinations
 
+# Interval class for each octave interval 0-12
+_IC_LUT = np.array([0, 1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1, 0], dtype=np.int8)
+
+# Chords with up to this many pitches are faster to handle in a Python loop
+_MAX_LOOP_PITCHES = 8
+
 
 def interval_consonance(pitches, weights, agg_method="type"):
     """
     Measure of consonance based on pairwise intervals in a chord.
 
     :param pitches: list of chord MIDI pitches
-    :param weights: consonance contribution for intervals 1-12
+    :param weights: consonance contribution for intervals 1-12, as list or array
     :param agg_method: "sum" or "type"
     :return: consonance value
     """
     intervals = get_octave_intervals(pitches)
     counts = count(intervals, range(1, 13))
 
-    if type(weights[0]) == list:
-        check_weight_exclusions(weights)
-        weights = get_inclusion_weights(counts, weights)
-
-    if len(weights) != 12:
-        raise Exception("weights must be of length 12")
-
-    if agg_method == "sum":
-        score = np.inner(counts, weights)
-    if agg_method == "type":
-        score = np.inner(counts / len(intervals), weights)
+    if isinstance(weights[0], list):
+        weights = _inclusion_weights(counts, weights)
 
-    return score
+    return _score(counts, weights, 12, len(intervals), agg_method)
 
 
 def interval_class_consonance(pitches, weights, agg_method="type"):
@@ -34,28 +34,36 @@ def interval_class_consonance(pitches, weights, agg_method="type"):
     Measure of consonance based on pairwise interval classes in a chord.
 
     :param pitches: list of chord MIDI pitches
-    :param weights: consonance contribution for intervals 0-6
+    :param weights: consonance contribution for intervals 0-6, as list or array
     :param agg_method: "sum" or "type"
     :return: consonance value
     """
     intervals = get_octave_intervals(pitches)
-    interval_classes = [interval_class(ivl) for ivl in intervals]
+    interval_classes = _IC_LUT[intervals]
     counts = count(interval_classes, range(7))
 
-    if type(weights[0]) == list:
-        check_weight_exclusions(weights)
-        weights = get_inclusion_weights(counts, weights)
+    if isinstance(weights[0], list):
+        weights = _inclusion_weights(counts, weights)
 
-    if len(weights) != 7:
-        raise Exception("weights must be of length 7")
+    return _score(counts, weights, 7, len(intervals), agg_method)
 
 
-    if agg_method == "sum":
-        score = np.inner(counts, weights)
-    if agg_method == "type":
-        score = np.inner(counts / len(intervals), weights)
+def _score(counts, weights, size, n_intervals, agg_method):
+    """Return consonance of chord interval counts for a single weights list or array."""
+    weights_arr = np.asarray(weights, dtype=float)
+    if len(weights_arr) != size:
+        raise Exception("weights must be of length %d" % size)
+
+    score = counts.dot(weights_arr)
+    # None weights become nan, which makes every score nan
+    if math.isnan(score) and any(w is None for w in weights):
+        raise Exception("weights must not contain None unless given as list of weights lists")
 
-    return score
+    if agg_method == "sum":
+        return score
+    elif agg_method == "type":
+        return score / n_intervals
+    raise Exception('agg_method must be "sum" or "type"')
 
 
 def check_weight_exclusions(weights_lsts):
@@ -71,16 +79,8 @@ def check_weight_exclusions(weights_lsts):
             raise Exception("weights lists must all have the same length")
 
     # Check exclusions
-    lst_ixs = [
-        sorted([i for i, w in enumerate(weights) if w == None])
-        for weights in weights_lsts
-    ]
-    lst_ixs.sort()
-    ixs = []
-    for lst in lst_ixs:
-        for ix in lst:
-            if ix not in ixs:
-                ixs.append(ix)
+    lst_ixs = sorted(excluded_ixs(weights) for weights in weights_lsts)
+    ixs = sorted(set().union(*lst_ixs))
     test_ixs = exclusion_combinations(ixs)
     if lst_ixs != test_ixs:
         raise Exception("exclusion combinations are not complete")
@@ -88,36 +88,105 @@ def check_weight_exclusions(weights_lsts):
 
 def exclusion_combinations(exclusion_ixs):
     """Return all combinations of excluded indices."""
-    output = [[]]
+    return [list(c) for c in _exclusion_combinations(tuple(sorted(exclusion_ixs)))]
+
+
+@lru_cache(maxsize=128)
+def _exclusion_combinations(exclusion_ixs):
+    output = [()]
     output += [
-        sorted(list(c)) for i in range(1, len(exclusion_ixs) + 1)
+        c for i in range(1, len(exclusion_ixs) + 1)
         for c in combinations(exclusion_ixs, i)
     ]
     output.sort()
-    return output
+    return tuple(output)
 
 
 def get_inclusion_weights(counts, weights_lsts):
     """Return weights set for chord interval counts."""
-    lst_ixs = [
-        sorted([i for i, w in enumerate(weights) if w == None])
-        for weights in weights_lsts
-    ]
+    weights = _inclusion_weights(counts, weights_lsts)
+    return None if weights is None else weights.tolist()
+
+
+def _inclusion_weights(counts, weights_lsts):
+    """Return read-only weights array for chord interval counts."""
+    for ixs, weights in _weight_variants(weights_lsts):
+        if not any(counts[j] > 0 for j in ixs):
+            return weights
+
+
+# Weight variants by id of weights lists, with the lists and a copy of their contents
+_weight_variants_cache = {}
+
+
+def _weight_variants(weights_lsts):
+    """
+    Return checked weight variants of weights lists, reusing them while the
+    same lists are passed with unchanged contents.
+    """
+    cached = _weight_variants_cache.get(id(weights_lsts))
+    if cached is not None and cached[0] is weights_lsts and cached[1] == weights_lsts:
+        return cached[2]
+
+    variants = _prep_weight_variants(weights_lsts)
+    if len(_weight_variants_cache) >= 32:
+        _weight_variants_cache.clear()
+    _weight_variants_cache[id(weights_lsts)] = (weights_lsts, [list(w) for w in weights_lsts], variants)
+    return variants
+
+
+def _prep_weight_variants(weights_lsts):
+    """
+    Check weights lists and return pairs of excluded indices and read-only
+    weights arrays, ordered from most to fewest exclusions.
+    """
+    check_weight_exclusions(weights_lsts)
+    lst_ixs = [excluded_ixs(weights) for weights in weights_lsts]
     order = np.flip(np.argsort([len(l) for l in lst_ixs]))
+    variants = []
     for i in order:
-        if not any(counts[j] > 0 for j in lst_ixs[i]):
-            return [0 if x is None else x for x in weights_lsts[i]]
+        weights = np.array([0 if x is None else x for x in weights_lsts[i]], dtype=float)
+        weights.flags.writeable = False
+        variants.append((tuple(lst_ixs[i]), weights))
+    return tuple(variants)
+
+
+def excluded_ixs(weights):
+    """Return indices of excluded (None) weights."""
+    return [i for i, w in enumerate(weights) if w is None]
 
 
 def get_octave_intervals(pitches):
     """Calculate all pairwise intervals, constrained to one octave."""
-    raw_intervals = [p2 - p1 for p1, p2 in combinations(pitches, 2)]
-    oct_intervals = [ivl % 12 for ivl in raw_intervals]
-    for i, ivl in enumerate(oct_intervals):
-        if ivl == 0:
-            oct_intervals[i] = 12
-    oct_intervals.sort()
-    return oct_intervals
+    if len(pitches) > _MAX_LOOP_PITCHES:
+        pitches = _integer_pitches(np.asarray(pitches))
+        i, j = _pair_idx(len(pitches))
+        oct_intervals = (pitches[j] - pitches[i]) % 12
+        oct_intervals[oct_intervals == 0] = 12
+        oct_intervals.sort()
+        return oct_intervals.tolist()
+
+    try:
+        pitches = list(map(operator.index, pitches))
+    except TypeError:
+        pitches = _integer_pitches(np.asarray(pitches)).tolist()
+    return sorted([(p2 - p1) % 12 or 12 for p1, p2 in combinations(pitches, 2)])
+
+
+def _integer_pitches(pitches):
+    """Return array of pitches as integers, raising if any are not whole numbers."""
+    if pitches.dtype.kind not in "iu" and np.any(pitches != np.round(pitches)):
+        raise Exception("pitches must be integer MIDI pitches")
+    return pitches.astype(int, copy=False)
+
+
+@lru_cache(maxsize=32)
+def _pair_idx(k):
+    """Return read-only indices of all pairs in a chord of size k."""
+    i, j = np.triu_indices(k, 1)
+    i.flags.writeable = False
+    j.flags.writeable = False
+    return i, j
 
 
 def interval_class(interval):
@@ -125,9 +194,27 @@ def interval_class(interval):
 
 
 def count(lst, items):
-    """Return counts for every item in lst."""
-    counts = np.zeros(len(items))
-    for x in lst:
-        counts[items.index(x)] += 1
-    return counts
-
+    """Return integer counts for every item in lst."""
+    ixs, size, gaps = _count_ixs(items if isinstance(items, range) else tuple(items))
+    lst = np.asarray(lst)
+    if lst.dtype.kind not in "iu":
+        if lst.size:
+            raise Exception("values to count must be integers")
+        lst = lst.astype(np.intp)
+    counts = np.bincount(lst, minlength=size)
+    if len(counts) > size:
+        raise Exception("lst contains values not in items")
+    for g in gaps:
+        if counts[g]:
+            raise Exception("lst contains values not in items")
+    return counts[ixs]
+
+
+@lru_cache(maxsize=32)
+def _count_ixs(items):
+    """Return indices of items, length of counts up to the largest item, and values below it that are not items."""
+    ixs = np.asarray(items, dtype=np.intp)
+    ixs.flags.writeable = False
+    size = int(ixs.max()) + 1
+    gaps = tuple(sorted(set(range(size)) - set(ixs.tolist())))
+    return ixs, size, gaps
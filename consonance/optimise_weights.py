@@ -1,5 +1,10 @@
 import numpy as np
-from consonance.consonance import exclusion_combinations, get_octave_intervals, interval_class, count
+from functools import lru_cache
+from itertools import chain
+from consonance.consonance import exclusion_combinations, get_octave_intervals, _integer_pitches, _IC_LUT
+
+# Datasets with at least this many chords compute intervals with Numba, if installed
+_NUMBA_MIN_CHORDS = 200000
 
 
 def optimise_interval_weights(pitches_lst, ratings, exclude_ivls=[], agg_method="type"):
@@ -13,23 +18,31 @@ def optimise_interval_weights(pitches_lst, ratings, exclude_ivls=[], agg_method=
     :return: if exclude_ivls is empty, list of interval weights;
              else list of weights lists for each combiniation including/excluding given intervals
     """
-    intervals_lst = np.array([get_octave_intervals(ps) for ps in pitches_lst], dtype=object)
-    interval_set = set(np.concatenate(intervals_lst))
+    intervals, offsets = chord_intervals(pitches_lst)
+    interval_set = set(np.flatnonzero(np.bincount(intervals)).tolist())
+
+    A = design_matrix(intervals, offsets, interval_set, agg_method)
 
     if exclude_ivls == []:
-        weights = optimise_weights(intervals_lst, ratings, interval_set, agg_method)
+        weights = solve_weights(A, ratings)
         weights = include_missing(weights, interval_set, range(1, 13))
 
     else:
+        if any(x not in range(1, 13) for x in exclude_ivls):
+            raise Exception("exclude_ivls must only contain intervals 1-12")
         exclusions = exclusion_combinations(exclude_ivls)
         exclusions.sort(key=len, reverse=True)
-        exclusion_groups = get_exclusion_groups(intervals_lst, exclusions)
+        exclusion_groups = get_exclusion_groups(intervals, offsets, exclusions)
+
+        ratings = np.asarray(ratings, dtype=float)
+        set_cols = np.array(sorted(interval_set))
 
         weights = []
         for i, ex in enumerate(exclusions):
             ex_ivl_set = {x for x in interval_set if x not in ex}
             mask = exclusion_groups == i
-            ex_weights = optimise_weights(intervals_lst[mask], ratings[mask], ex_ivl_set, agg_method)
+            col_mask = ~np.isin(set_cols, ex)
+            ex_weights = solve_weights(A[np.ix_(mask, col_mask)], ratings[mask])
             ex_weights = include_missing(ex_weights, ex_ivl_set, range(1, 13))
             weights.append(ex_weights)
 
@@ -47,26 +60,32 @@ def optimise_interval_class_weights(pitches_lst, ratings, exclude_ivcs=[], agg_m
     :return: if exclude_ivcs is empty, list of interval-class weights;
              else list of weights lists for each combiniation including/excluding given classes
     """
-    ivclasses_lst = np.array([
-        [interval_class(ivl) for ivl in get_octave_intervals(ps)]
-        for ps in pitches_lst
-    ], dtype=object)
-    ivclass_set = set(np.concatenate(ivclasses_lst))
+    intervals, offsets = chord_intervals(pitches_lst)
+    ivclasses = _IC_LUT[intervals]
+    ivclass_set = set(np.flatnonzero(np.bincount(ivclasses)).tolist())
+
+    A = design_matrix(ivclasses, offsets, ivclass_set, agg_method)
 
     if exclude_ivcs == []:
-        weights = optimise_weights(ivclasses_lst, ratings, ivclass_set, agg_method)
+        weights = solve_weights(A, ratings)
         weights = include_missing(weights, ivclass_set, range(7))
 
     else:
+        if any(x not in range(0, 7) for x in exclude_ivcs):
+            raise Exception("exclude_ivcs must only contain interval classes 0-6")
         exclusions = exclusion_combinations(exclude_ivcs)
         exclusions.sort(key=len, reverse=True)
-        exclusion_groups = get_exclusion_groups(ivclasses_lst, exclusions)
+        exclusion_groups = get_exclusion_groups(ivclasses, offsets, exclusions)
+
+        ratings = np.asarray(ratings, dtype=float)
+        set_cols = np.array(sorted(ivclass_set))
 
         weights = []
         for i, ex in enumerate(exclusions):
             ex_ivc_set = {x for x in ivclass_set if x not in ex}
             mask = exclusion_groups == i
-            ex_weights = optimise_weights(ivclasses_lst[mask], ratings[mask], ex_ivc_set, agg_method)
+            col_mask = ~np.isin(set_cols, ex)
+            ex_weights = solve_weights(A[np.ix_(mask, col_mask)], ratings[mask])
             ex_weights = include_missing(ex_weights, ex_ivc_set, range(7))
             weights.append(ex_weights)
 
@@ -75,46 +94,99 @@ def optimise_interval_class_weights(pitches_lst, ratings, exclude_ivcs=[], agg_m
 
 def optimise_weights(intervals_lst, ratings, interval_set, agg_method="type"):
     """Optimise weights by minimising sum-of-squares function."""
-    if len(intervals_lst) != len(ratings):
-        raise Exception("lists of chords and ratings must be same length")
+    intervals, offsets = flatten_intervals(list(intervals_lst))
+    A = design_matrix(intervals, offsets, interval_set, agg_method)
+    return solve_weights(A, ratings)
 
-    n = len(ratings)
+
+def design_matrix(intervals, offsets, interval_set, agg_method="type"):
+    """Return matrix of interval counts for every chord, with columns in order of interval_set."""
+    n = len(offsets) - 1
     m = len(interval_set)
-    A = np.zeros((n, m))
-    for i in range(n):
-        counts = count(intervals_lst[i], list(interval_set))
-        if agg_method == "sum":
-            A[i, :] = counts
-        if agg_method == "type":
-            A[i, :] = counts / len(intervals_lst[i])
-
-    At = np.matrix.transpose(A)
-    B = np.linalg.inv(np.matmul(At, A))
-    weights = np.matmul(B, np.matmul(At, ratings))
 
+    # Map interval values to column indices in A
+    ivl_cols = np.fromiter(sorted(interval_set), dtype=np.intp, count=m)
+    lut = np.full(13, -1, dtype=np.intp)
+    lut[ivl_cols] = np.arange(m)
+    if np.any(lut[intervals] < 0):
+        raise Exception("chord intervals must all be in interval_set")
+    if agg_method == "type" and np.any(np.diff(offsets) == 0):
+        raise Exception("chords must have at least two pitches when agg_method is \"type\"")
+
+    rows = chord_index(offsets)
+    A = np.bincount(rows * m + lut[intervals], minlength=n * m).reshape(n, m).astype(float)
+    if agg_method == "type":
+        A /= np.diff(offsets)[:, None]
+    return A
+
+
+def solve_weights(A, ratings):
+    """Return least-squares weights for design matrix A and ratings."""
+    if len(A) != len(ratings):
+        raise Exception("lists of chords and ratings must be same length")
+    weights, _, rank, _ = np.linalg.lstsq(A, np.asarray(ratings, dtype=float), rcond=None)
+    if rank < A.shape[1]:
+        raise np.linalg.LinAlgError("Singular matrix: not enough chords to determine all weights")
     return weights.tolist()
 
 
 def include_missing(weights, interval_set, full_range):
     """Return weights with missing intervals as None."""
-    full_weights = []
-    j = 0
-    for i in full_range:
-        if i in interval_set:
-            full_weights.append(weights[j])
-            j += 1
-        else:
-            full_weights.append(None)
-    return full_weights
-
-
-def get_exclusion_groups(intervals_lst, exclusions):
-    """For each chord, find group where no chord intervals are excluded."""
-    exclusion_group = np.empty(intervals_lst.size)
-    for i, ivls in enumerate(intervals_lst):
-        for j, ex in enumerate(exclusions):
-            if all(ivl not in ex for ivl in ivls):
-                exclusion_group[i] = j
-                break
-    return exclusion_group
+    full_range = np.asarray(full_range)
+    full_weights = np.full(len(full_range), None, dtype=object)
+    full_weights[np.isin(full_range, sorted(interval_set))] = weights
+    return full_weights.tolist()
 
+
+def get_exclusion_groups(intervals, offsets, exclusions):
+    """For each chord, find group where no chord intervals are excluded."""
+    present = np.zeros((len(offsets) - 1, 13), dtype=np.int8)
+    present[chord_index(offsets), intervals] = 1
+    excluded = np.zeros((len(exclusions), 13), dtype=np.int8)
+    for j, ex in enumerate(exclusions):
+        if any(x not in range(13) for x in ex):
+            raise Exception("excluded intervals must be in range 0-12")
+        excluded[j, ex] = 1
+    conflicts = present @ excluded.T
+    return np.argmax(conflicts == 0, axis=1)
+
+
+def chord_intervals(pitches_lst):
+    """Return octave intervals of all chords concatenated, with offsets where each chord starts."""
+    octave_intervals = _numba_octave_intervals() if len(pitches_lst) >= _NUMBA_MIN_CHORDS else None
+    if octave_intervals is None:
+        return flatten_intervals([get_octave_intervals(ps) for ps in pitches_lst])
+
+    n_pitches = np.fromiter(map(len, pitches_lst), dtype=np.intp, count=len(pitches_lst))
+    pitch_offsets = np.zeros(len(n_pitches) + 1, dtype=np.intp)
+    np.cumsum(n_pitches, out=pitch_offsets[1:])
+    offsets = np.zeros(len(n_pitches) + 1, dtype=np.intp)
+    np.cumsum(n_pitches * (n_pitches - 1) // 2, out=offsets[1:])
+    pitches = _integer_pitches(np.array(list(chain.from_iterable(pitches_lst))))
+    return octave_intervals(pitches, pitch_offsets, offsets), offsets
+
+
+@lru_cache(maxsize=1)
+def _numba_octave_intervals():
+    """Import the Numba interval kernel on first use, or return None if Numba is not installed."""
+    try:
+        from consonance._numba_kernels import octave_intervals
+    except ImportError:
+        return None
+    return octave_intervals
+
+
+def flatten_intervals(intervals_lst):
+    """Return intervals of all chords concatenated, with offsets where each chord starts."""
+    offsets = np.zeros(len(intervals_lst) + 1, dtype=np.intp)
+    np.cumsum([len(ivls) for ivls in intervals_lst], out=offsets[1:])
+    intervals = np.concatenate(intervals_lst)
+    if intervals.size and (intervals.dtype.kind not in "iu" or intervals.min() < 0 or intervals.max() > 12):
+        raise Exception("intervals must be integers in range 0-12")
+    return intervals.astype(np.int8, copy=False), offsets
+
+
+def chord_index(offsets):
+    """Return index of chord for every flattened interval."""
+    lengths = np.diff(offsets)
+    return np.repeat(np.arange(len(lengths)), lengths)